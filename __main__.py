@@ -3,6 +3,7 @@
 The chart is in the form of an html document with embedded javascript.
 """
 
+from argparse import ArgumentParser
 from collections import defaultdict
 from deployment.datastore import Datastore
 from deployment.device import SectorDevice
@@ -35,6 +36,9 @@ STATUS = {
         'status-code': 4}
 }
 
+# Flattened STATUS lookups used while rendering every feature.
+STATUS_COLOR = {name: status['color'] for name, status in STATUS.items()}
+
 
 def get_install_data(api_key, thread_id):
     """Pull data config data from the quip doc."""
@@ -48,7 +52,7 @@ def get_install_data(api_key, thread_id):
     quip_data = quip.dictReader(access_token=api_key,
                                 thread_id=thread_id)
 
-    return filter(is_installed_sector, quip_data)
+    return list(filter(is_installed_sector, quip_data))
 
 
 def infer_devices_to_nodes(install_data):
@@ -79,18 +83,13 @@ def apply_spacial_map(geojson_data, device_map):
     """Transform a mapping to use ids instead of 'common names' as keys.
 
     Keep the same values but convert the keys to uids of the known objects.
-    This makes working with the mapping more efficient.
+    Names that do not match a known object are dropped. This makes working
+    with the mapping more efficient.
     """
-    try:
-        name_map = {f.properties['desc']: f['id'] for f in geojson_data}
-    except:
-        print [f.properties['desc'] for f in geojson_data if 'id' not in f]
-
-    for key, values in device_map.items():
-        description = name_map[key]
-        device_map[description] = values
-        del device_map[key]
-    return device_map
+    name_map = {f.properties['desc']: f['id'] for f in geojson_data
+                if 'desc' in f.properties}
+    return {name_map[name]: values for name, values in device_map.items()
+            if name in name_map}
 
 
 def create_node_level_graph(nodes, edges):
@@ -99,12 +98,18 @@ def create_node_level_graph(nodes, edges):
     This is implemented as a sparsely connected graph and uses an adjacency
     list of features(nodes and observations) to store relationships.
     """
-    graph = defaultdict(list)
-    for node_id, node_devices in nodes.iteritems():
-        for link_id, link_devices in edges.iteritems():
-            if not set(link_devices).isdisjoint(set(node_devices)):
-                graph[node_id].append(link_id)
-    return dict(graph)
+    host_to_links = defaultdict(list)
+    for link_id, link_devices in edges.items():
+        for hostname in link_devices:
+            host_to_links[hostname].append(link_id)
+
+    graph = {}
+    for node_id, node_devices in nodes.items():
+        links = {link_id for hostname in node_devices
+                 for link_id in host_to_links.get(hostname, ())}
+        if links:
+            graph[node_id] = list(links)
+    return graph
 
 
 def generate_device_status(node_map, edge_map, install_data):
@@ -113,12 +118,12 @@ def generate_device_status(node_map, edge_map, install_data):
     This may better be called, associate with geospacial data id.
     """
     devices = {}
-    for node_id, unique_device_ids in node_map.iteritems():
+    for node_id, unique_device_ids in node_map.items():
         for hostname in unique_device_ids:
             devices[hostname] = SectorDevice(id=hostname,
                                              mount_point_id=node_id)
 
-    for link_id, unique_device_ids in edge_map.iteritems():
+    for link_id, unique_device_ids in edge_map.items():
         for unique_device_id in unique_device_ids:
             try:
                 devices[unique_device_id].radio_link_id = link_id
@@ -133,7 +138,7 @@ def generate_device_status(node_map, edge_map, install_data):
         devices[hostname].oob_ip_address = device_config['ipv6_admin_address']
         devices[hostname].hostname = device_config['hostname']
 
-    return devices.values()
+    return list(devices.values())
 
 
 def update_nodes(geojson_data, devices):
@@ -148,35 +153,39 @@ def update_nodes(geojson_data, devices):
             return 'No known devices installed'
         else:
             return ' '.join(list('{} is {}\n'.format(name, status)
-                            for name, status in results.iteritems()))
-
-    for feature in geojson_data:
-        ping_results = {device.id: device.status_ping
-                        for device in devices
-                        if device.mount_point_id == feature['id']}
+                            for name, status in results.items()))
 
-        login_results = {device.id: device.status_login
-                         for device in devices
-                         if device.mount_point_id == feature['id']}
+    devices_by_mount_point = defaultdict(list)
+    for device in devices:
+        devices_by_mount_point[device.mount_point_id].append(device)
 
-        radio_link_results = {device.id: device.status_radio_link
-                              for device in devices
-                              if device.mount_point_id == feature['id']}
+    for feature in geojson_data:
+        feature_devices = devices_by_mount_point.get(feature['id'], ())
+        ping_results = {d.id: d.status_ping for d in feature_devices}
+        login_results = {d.id: d.status_login for d in feature_devices}
+        radio_link_results = {d.id: d.status_radio_link
+                              for d in feature_devices}
 
         feature.properties['Ping Status'] = pretty_status(ping_results)
         feature.properties['Login Status'] = pretty_status(login_results)
         feature.properties['Radio Status'] = pretty_status(radio_link_results)
 
-        if not ping_results:
+        n_total = len(ping_results)
+        n_up = n_down = 0
+        for status in ping_results.values():
+            if status == 'up':
+                n_up += 1
+            elif status == 'down':
+                n_down += 1
+
+        if not n_total:
             feature.properties['Overall Status'] = 'unknown'
-        elif all(map(lambda x: x is 'down', ping_results.values())):
+        elif n_down == n_total:
             feature.properties['Overall Status'] = 'down'
-        elif all(map(lambda x: x is 'up', ping_results.values())):
+        elif n_up == n_total:
             feature.properties['Overall Status'] = 'up'
-        elif any(map(lambda x: x is 'up', ping_results.values())):
+        elif n_up:
             feature.properties['Overall Status'] = 'partial-up'
-        else:
-            pass
     return geojson_data
 
 
@@ -185,39 +194,38 @@ def render_mpk_chart(features):
 
     Input is a list of features in python dict format.Output is a html file.
     """
-    TABLE_OUTER = ('<center><h2>{title}</h2></center>'
-                   '<table border="1" style="width:100%">'
-                   '{table_rows}'
-                   '</table>')
-
-    TABLE_ROW = '<tr><td>{title}</td><td>{value}</td></tr>'
+    def table_row(name, value):
+        """Return a popup table row with newlines converted to html."""
+        name = name.replace('\n', '<br>')
+        value = value.replace('\n', '<br>')
+        return f'<tr><td>{name}</td><td>{value}</td></tr>'
 
     mpk_chart = folium.Map(location=[37.484511, -122.14710], zoom_start=18)
 
     for feature in features:
-        rows = ''.join([TABLE_ROW.format(title=name.replace('\n', '<br>'),
-                                         value=value.replace('\n', '<br>'))
-                        for (name, value) in feature.properties.items()])
+        properties = feature.properties
+        rows = ''.join([table_row(name, value)
+                        for name, value in properties.items()])
 
-        popup_html = TABLE_OUTER.format(title=feature.properties['desc'],
-                                        table_rows=rows)
+        popup_html = (f'<center><h2>{properties["desc"]}</h2></center>'
+                      f'<table border="1" style="width:100%">{rows}</table>')
 
         popup = folium.Popup(folium.element.IFrame(html=popup_html,
                                                    width=350,
                                                    height=350),
                              max_width=350)
 
-        status = feature.properties['Overall Status']
+        status = properties['Overall Status']
         if feature.geometry['type'] == 'LineString':
             ((lng1, lat1), (lng2, lat2)) = feature.geometry['coordinates']
             folium.PolyLine(locations=[(lat1, lng1), (lat2, lng2)],
-                            color=STATUS[status]['color'],
+                            color=STATUS_COLOR[status],
                             popup=popup).add_to(mpk_chart)
 
         elif feature.geometry['type'] == 'Point':
             (lng1, lat1) = feature.geometry['coordinates'][0:2]
             icon = folium.Icon(color='white',
-                               icon_color=STATUS[status]['color'])
+                               icon_color=STATUS_COLOR[status])
 
             folium.Marker(location=[lat1, lng1],
                           popup=popup,
@@ -227,6 +235,11 @@ def render_mpk_chart(features):
 
 
 if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--batch', action='store_true',
+                        help='load the default data set without prompting')
+    args = parser.parse_args()
+
     with open('config_settings.json', 'r') as f:
         settings = json.loads(f.read())
 
@@ -234,7 +247,8 @@ if __name__ == '__main__':
     browser = webdriver.Firefox()
 
     geospacial_data.load_data(choice=settings['default_load_choice'],
-                              file_path=settings['default_load_file'])
+                              file_path=settings['default_load_file'],
+                              batch=args.batch)
 
     iteration = 0
     while True:
@@ -254,8 +268,8 @@ if __name__ == '__main__':
                                                    edge_map=link_map,
                                                    install_data=device_data)
 
+        SectorDevice.test_ping_batch(mpk_device_status)
         for device in mpk_device_status:
-            device.test_ping()
             device.test_login()
             device.test_radio_link()
 
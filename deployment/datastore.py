@@ -4,12 +4,18 @@ Store persistent serialized data in text documents from python objects and vic
 versa. Also provides helper functions to manage DeploymentFeature objects.
 """
 
-from gis_feature import DeploymentFeature
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from itertools import chain
+from .gis_feature import DeploymentFeature
 from github3 import login, GitHubError
-from geojson import Feature, FeatureCollection, loads, dumps
-from os import makedirs, walk, path
+from geojson import Feature, FeatureCollection
+from operator import itemgetter
+from os import cpu_count, makedirs, path, scandir
 from uuid import uuid4
-import json
+import ijson
+import orjson
 
 
 class Datastore(object):
@@ -24,10 +30,19 @@ class Datastore(object):
 
     def __init__(self, config_file=None):
         """init DeploymentFeatures that are stored in the Datastore class."""
-        self._data = {}
+        self._buckets = {
+            'site': {},
+            'mountpoint': {},
+            'observation': {},
+            'device': {},
+            'link': {}
+        }
+        self._all = None
+        self._pending = None
+        self._interactive = True
         try:
-            with open(config_file, 'r') as f:
-                self._settings = json.loads(f.read())
+            with open(config_file, 'rb') as f:
+                self._settings = orjson.loads(f.read())
         except (IOError):
             self._settings = {}
             print('Unable to load settings file: File does not exsist.')
@@ -40,68 +55,146 @@ class Datastore(object):
         if not isinstance(value, DeploymentFeature):
             print('This is not a DeploymentFeature!\n{}'.format(value))
             raise TypeError
-        self._data[key] = value
+        self._store(key, value)
 
     def __getattr__(self, name):
         """Get attributes available in the Datastore class.
 
-        Perform simple filtering of object types for easy manipultion.
+        Features are kept in per subtype buckets for easy manipultion.
         """
-        if name is 'sites':
-            return [f for f in self._data.values()
-                    if f.subtype == 'site']
-        elif name is 'mountpoints':
-            return [f for f in self._data.values()
-                    if f.subtype == 'mountpoint']
-        elif name is 'observations':
-            return [f for f in self._data.values()
-                    if f.subtype == 'observation']
-        elif name is 'all':
-            return self._data.values()
-        elif name is 'settings':
+        if name == 'sites':
+            return list(self._buckets['site'].values())
+        elif name == 'mountpoints':
+            return list(self._buckets['mountpoint'].values())
+        elif name == 'observations':
+            return list(self._buckets['observation'].values())
+        elif name == 'all':
+            if self._all is None:
+                self._all = tuple(chain.from_iterable(
+                    bucket.values() for bucket in self._buckets.values()))
+            return self._all
+        elif name == 'settings':
             return self._settings
 
-    def add(self, feature):
+    def _store(self, key, feature):
+        """Store a feature in the bucket of its subtype.
+
+        The feature calls back into _store when its subtype changes, so it is
+        moved to its new bucket.
+        """
+        for bucket in self._buckets.values():
+            previous = bucket.pop(key, None)
+            if previous is not None and previous is not feature:
+                previous.__dict__.pop('_subtype_listener', None)
+
+        self._buckets.setdefault(feature.subtype, {})[key] = feature
+        feature.__dict__['_subtype_listener'] = partial(self._store, key)
+        self._all = None
+        if self._pending is not None:
+            self._pending.append(feature)
+
+    def add(self, feature, unchecked=False):
         """Validate and add instance of DeploymentFeature to the Datastore set.
 
         :param feature: A feature to add
         :type feature: DeploymentFeature
+        :param unchecked: Skip geojson validation of the feature geometry.
+            Point and LineString coordinates still get a cheap check, and
+            any other geometry is validated as usual.
+        :type unchecked: bool
         """
         try:
             identitifier = str(feature.get('id', uuid4()))
+            geometry = feature['geometry']
+            if unchecked:
+                if (not isinstance(geometry, dict) or
+                        geometry.get('type') not in ('Point', 'LineString')):
+                    unchecked = False
+                elif not _valid_coordinates(geometry):
+                    print('Invalid coordinates, skipping {}'.format(
+                        identitifier))
+                    return
+
             properties = feature.get('properties')
+            if properties is None:
+                properties = {}
             subtype = properties.get('subtype')
 
             while subtype is None:
                 print('{} subtype not specified.'.format(identitifier))
-                subtype = raw_input('Assign subtype [site]: ') or 'site'
+                subtype = self._ask('Assign subtype [site]: ', 'site')
+            properties['subtype'] = subtype
 
             new_feature = DeploymentFeature(id=identitifier,
-                                            geometry=feature['geometry'],
+                                            geometry=geometry,
                                             subtype=subtype,
-                                            properties=properties)
+                                            properties=properties,
+                                            unchecked=unchecked)
 
-            self._data[identitifier] = new_feature
+            self._store(identitifier, new_feature)
 
         except (OSError, TypeError):
             print('Failed to properly add/import {}'.format(identitifier))
         except (AttributeError):
-            print('{} subtype not specified.'.format(identitifier))
-            subtype = raw_input('Assign subtype [site]: ') or 'site'
+            print('Invalid properties, skipping {}'.format(identitifier))
+
+    @contextmanager
+    def _bulk_load(self):
+        """Defer precision normalization of added features until exit.
+
+        Features added inside the block are normalized together once it
+        completes. If the load fails, they are still normalized and the
+        original error is raised.
+        """
+        self._pending = []
+        DeploymentFeature.defer_normalize = True
+        try:
+            yield
+        except Exception:
+            for feature in self._pending:
+                feature.normalize_precision()
+            raise
+        finally:
+            DeploymentFeature.defer_normalize = False
+            pending, self._pending = self._pending, None
+        self._bulk_normalize(pending)
+
+    def _bulk_normalize(self, features):
+        """Normalize the precision of the features added by a bulk load.
+
+        Each feature goes through DeploymentFeature.normalize_precision, so
+        bulk loaded coordinates are rounded exactly like features added one
+        at a time.
+        """
+        for feature in features:
+            feature.normalize_precision()
 
     def load_folder(self, folder):
         """Load geojson files from a folder and store them in the Datastore."""
-        for (dirpath, dirnames, filenames) in walk(folder):
-            for filename in filenames:
-                try:
-                    file_path = path.join(dirpath, filename)
-                    with open(file_path, 'r') as f:
-                        feature = loads(f.read())
-                        self.add(feature)
-                except (IOError), error:
-                    print(error)
-                except:
-                    print('Unable to load {}.'.format(filename))
+        if not folder:
+            print('ERROR: no folder specified to load from.')
+            return
+
+        def read_feature(file_path):
+            """Read and parse a single geojson feature file."""
+            with open(file_path, 'rb') as f:
+                return orjson.loads(f.read())
+
+        # Reads and parsing run in the pool; adding stays on this thread.
+        max_workers = min(32, (cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [(file_path, executor.submit(read_feature, file_path))
+                       for file_path in _scan_files(folder)]
+
+            with self._bulk_load():
+                for file_path, future in futures:
+                    try:
+                        self.add(future.result())
+                    except IOError as error:
+                        print(error)
+                    except:
+                        print('Unable to load {}.'.format(
+                            path.basename(file_path)))
         print('SUCCESS: files loaded!')
 
     def write_folder(self, folder):
@@ -114,33 +207,61 @@ class Datastore(object):
             'link': 'link-objects'
         }
 
-        for feature in self.all:
-            file_name = feature.id + '.json'
-            sub_path = path.join(folder, FOLDERS[feature.subtype])
-            full_path = path.join(sub_path, file_name)
+        for subtype, bucket in self._buckets.items():
+            if not bucket:
+                continue
+
+            sub_path = path.join(folder, FOLDERS[subtype])
             if not path.exists(sub_path):
                 makedirs(sub_path)
 
-            with open(full_path, 'w')as f:
-                f.write(format_to_geojson(feature))
+            for feature in bucket.values():
+                full_path = path.join(sub_path, feature.id + '.json')
+                with open(full_path, 'w')as f:
+                    f.write(format_to_geojson(feature))
 
     def load_geojson_file(self, file_path):
         """Load features from single geojson document."""
         try:
-            with open(file_path, 'r') as f:
-                feature_collection = f.read()
+            with open(file_path, 'rb') as f:
+                features = ijson.items(f, 'features.item', use_float=True)
+                with self._bulk_load():
+                    for feature in features:
+                        self.add(feature, unchecked=True)
+            print('SUCCESS: file loaded!')
+        except IOError as error:
+            print(error)
 
-            features = loads(feature_collection).features
-            for feature in features:
-                self.add(feature)
+    def load_geojson_seq(self, file_path):
+        """Load features from a newline delimited geojson sequence file.
+
+        Each line holds a single feature (RFC 7464 record separators are
+        tolerated) so the file is parsed one feature at a time.
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                with self._bulk_load():
+                    for line in f:
+                        line = line.strip(b'\x1e \t\r\n')
+                        if line:
+                            self.add(orjson.loads(line), unchecked=True)
             print('SUCCESS: file loaded!')
-        except (IOError), error:
+        except IOError as error:
             print(error)
 
-    def write_geojson_file(self, file_path):
-        """Save all objects as a single geojson collection in a local file."""
-        with open(file_path, 'w') as f:
-            f.write(format_to_geojson(self.all))
+    def write_geojson_file(self, file_path, seq=False):
+        """Save all objects as a single geojson collection in a local file.
+
+        If seq is set, write one feature per line instead so the file can be
+        streamed back in with load_geojson_seq.
+        """
+        if seq:
+            with open(file_path, 'wb') as f:
+                for feature in sorted(self.all, key=itemgetter('id')):
+                    f.write(orjson.dumps(feature) + b'\n')
+        else:
+            with open(file_path, 'w') as f:
+                f.write(format_to_geojson(self.all))
 
     def load_gist(self, github_user, github_psswd, gist_id):
         """Load a geojson collection from a gist repo."""
@@ -150,11 +271,12 @@ class Datastore(object):
             for file in display_gist.iter_files():
                 feature_collection = file.content
 
-            for feature in loads(feature_collection).features:
-                self.add(feature)
+            with self._bulk_load():
+                for feature in orjson.loads(feature_collection)['features']:
+                    self.add(feature)
 
             print('SUCCESS: gist id {} loaded!'.format(gist_id))
-        except(GitHubError, AttributeError), error:
+        except (GitHubError, AttributeError) as error:
             print('ERROR: load failed due to {}'.format(error))
 
     def write_gist(self, github_user, github_psswd, gist_id):
@@ -165,12 +287,16 @@ class Datastore(object):
             collection = format_to_geojson(self.all)
             gist.edit(files={gist_id + '.geojson': {"content": collection}})
             print('SUCCESS: gist id {} saved!'.format(gist_id))
-        except(GitHubError, AttributeError), error:
+        except (GitHubError, AttributeError) as error:
             print('ERROR: save failed due to {}'.format(error))
 
     def load_data(self, choice=1, folder=None, file_path=None, gh_gist_id=None,
-                  gh_username=None, gh_password=None):
-        """Load data into Datastore based on user supplied input."""
+                  gh_username=None, gh_password=None, batch=False):
+        """Load data into Datastore based on user supplied input.
+
+        If batch is set, load once from the given choice and options without
+        prompting.
+        """
         PROMPT = ('\n============LOAD MENU================='
                   '\nLoad multiple data sets in the following ways:'
                   '\n1 => From a folder'
@@ -179,39 +305,25 @@ class Datastore(object):
                   '\n4 => Do not load additional data'
                   '\nEnter menue choice[{}]: ')
 
-        while True:
-            try:
-                choice = int(raw_input(PROMPT.format(choice)) or choice)
-            except(ValueError):
-                print('Invalid choice')
-
-            if choice is 1:
-                folder_prompt = 'Enter folder name[{}]: '.format(folder)
-                folder = raw_input(folder_prompt) or folder
-                self.load_folder(folder)
-
-            if choice is 2:
-                file_prompt = 'Enter file name[{}]: '.format(file_path)
-                file_path = raw_input(file_prompt) or file_path
-                self.load_geojson_file(file_path)
-
-            if choice is 3:
-                user_prompt = 'Enter username[{}]: '.format(gh_username)
-                gh_username = raw_input(user_prompt) or gh_username
-                password_prompt = 'Enter password[{}]: '.format(gh_password)
-                gh_password = raw_input(password_prompt) or gh_password
-                gist_prompt = 'Enter gist ID[{}]: '.format(gh_gist_id)
-                gh_gist_id = raw_input(gist_prompt) or gh_gist_id
-                self.load_gist(gh_username, gh_password, gh_gist_id)
+        actions = {
+            1: (self.load_folder, ('folder',)),
+            2: (self.load_geojson_file, ('file_path',)),
+            3: (self.load_gist, ('gh_username', 'gh_password', 'gh_gist_id'))
+        }
 
-            if choice is 4:
-                break
+        opts = {'folder': folder, 'file_path': file_path,
+                'gh_gist_id': gh_gist_id, 'gh_username': gh_username,
+                'gh_password': gh_password}
 
-            choice = 4
+        self._run_menu(PROMPT, actions, choice, opts, batch)
 
     def save_data(self, choice=1, folder=None, file_path=None, gh_gist_id=None,
-                  gh_username=None, gh_password=None):
-        """Save data into Datastore based on user supplied input."""
+                  gh_username=None, gh_password=None, batch=False):
+        """Save data into Datastore based on user supplied input.
+
+        If batch is set, save once to the given choice and options without
+        prompting.
+        """
         PROMPT = ('\n============SAVE MENU================='
                   '\nSave current data set to multiple locations/formats:'
                   '\n1 => To a folder'
@@ -220,48 +332,121 @@ class Datastore(object):
                   '\n4 => Do not save in additional formats/locations'
                   '\nEnter choice[{}]: ')
 
-        while True:
-            try:
-                choice = int(raw_input(PROMPT.format(choice)) or choice)
-            except(ValueError):
-                print('Invalid choice')
+        actions = {
+            1: (self.write_folder, ('folder',)),
+            2: (self.write_geojson_file, ('file_path',)),
+            3: (self.write_gist, ('gh_username', 'gh_password', 'gh_gist_id'))
+        }
 
-            if choice is 1:
-                folder_prompt = 'Enter folder name[{}]: '.format(folder)
-                folder = raw_input(folder_prompt) or folder
-                self.write_folder(folder)
+        opts = {'folder': folder, 'file_path': file_path,
+                'gh_gist_id': gh_gist_id, 'gh_username': gh_username,
+                'gh_password': gh_password}
 
-            if choice is 2:
-                file_prompt = 'Enter file name[{}]: '.format(file_path)
-                file_path = raw_input(file_prompt) or file_path
-                self.write_geojson_file(file_path)
+        self._run_menu(PROMPT, actions, choice, opts, batch)
 
-            if choice is 3:
-                user_prompt = 'Enter username[{}]: '.format(gh_username)
-                gh_username = raw_input(user_prompt) or gh_username
-                password_prompt = 'Enter password[{}]: '.format(gh_password)
-                gh_password = raw_input(password_prompt) or gh_password
-                gist_prompt = 'Enter gist ID[{}]: '.format(gh_gist_id)
-                gh_gist_id = raw_input(gist_prompt) or gh_gist_id
-                self.write_gist(gh_username, gh_password, gh_gist_id)
+    def _run_menu(self, prompt, actions, choice, opts, batch):
+        """Prompt for menu choices and their options until the user quits.
 
-            if choice is 4:
-                break
+        In batch mode the choice is dispatched once with the given options.
+        """
+        OPTION_PROMPTS = {
+            'folder': 'Enter folder name',
+            'file_path': 'Enter file name',
+            'gh_username': 'Enter username',
+            'gh_password': 'Enter password',
+            'gh_gist_id': 'Enter gist ID'
+        }
 
-            choice = 4
+        self._interactive = not batch
+        try:
+            while True:
+                if not batch:
+                    try:
+                        choice = int(input(prompt.format(choice)) or choice)
+                    except ValueError:
+                        print('Invalid choice')
+
+                    for name in actions.get(choice, (None, ()))[1]:
+                        option_prompt = '{}[{}]: '.format(OPTION_PROMPTS[name],
+                                                          opts[name])
+                        opts[name] = input(option_prompt) or opts[name]
+
+                _dispatch(choice, actions, opts)
+
+                if batch or choice == 4:
+                    break
+
+                choice = 4
+        finally:
+            self._interactive = True
+
+    def _ask(self, prompt, default):
+        """Prompt the user for a value, or use the default in batch mode."""
+        if not self._interactive:
+            return default
+        return input(prompt) or default
+
+
+def _valid_coordinates(geometry):
+    """Return if a Point or LineString has numeric 2D or 3D positions."""
+    def valid_position(position):
+        return (isinstance(position, (list, tuple)) and
+                2 <= len(position) <= 3 and
+                all(type(x) in (float, int) for x in position))
+
+    coordinates = geometry.get('coordinates')
+    if geometry['type'] == 'Point':
+        return valid_position(coordinates)
+    return (isinstance(coordinates, (list, tuple)) and
+            len(coordinates) >= 2 and
+            all(valid_position(position) for position in coordinates))
+
+
+def _scan_files(folder):
+    """Yield the path of every file below a folder."""
+    try:
+        entries = list(scandir(folder))
+    except OSError as error:
+        print(error)
+        return
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from _scan_files(entry.path)
+        elif entry.is_file():
+            yield entry.path
+
+
+def _dispatch(choice, actions, opts):
+    """Call the action for a menu choice with its options.
+
+    :param choice: Menu choice selected.
+    :type choice: int
+    :param actions: Map of choice to (callable, option names) pairs.
+    :type actions: dict
+    :param opts: Map of option name to value.
+    :type opts: dict
+    :return: True if the choice mapped to an action.
+    :rtype: bool
+    """
+    if choice not in actions:
+        return False
+    action, names = actions[choice]
+    action(*[opts[name] for name in names])
+    return True
 
 
 def format_to_geojson(obj):
     """Convert DeploymentFeatures to an ordered geojson txt string."""
-    if isinstance(obj, list):
-        obj = [Feature(
+    if isinstance(obj, (list, tuple)):
+        obj = [feature if isinstance(feature, Feature) else Feature(
             id=feature.id,
             geometry=feature.geometry,
             properties=feature.properties
             ) for feature in obj]
 
-        obj.sort(lambda x, y: cmp(x['id'], y['id']))
+        obj.sort(key=itemgetter('id'))
         obj = FeatureCollection(obj)
 
-    return dumps(obj, sort_keys=True,
-                 indent=4, separators=(',', ': '))
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS |
+                        orjson.OPT_INDENT_2).decode('utf-8')
@@ -1,6 +1,9 @@
 """Define a network device that is deployed."""
 
-import os
+import asyncio
+import subprocess
+
+PING_COMMAND = ('ping6', '-c', '1', '-W', '1')
 
 
 class SectorDevice(object):
@@ -26,8 +29,42 @@ class SectorDevice(object):
 
     def test_ping(self):
         """Test if an IP is pingable from the script endpoint."""
-        response = os.system("ping6 -c 1 {}".format(self.oob_ip_address))
-        if response is 0:
+        try:
+            response = subprocess.call(PING_COMMAND + (self.oob_ip_address,),
+                                       stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+        except OSError:
+            response = None
+        self._set_ping_status(response)
+
+    @classmethod
+    def test_ping_batch(cls, devices):
+        """Test if the IPs of many devices are pingable, all at once.
+
+        Every device is pinged concurrently, so the whole batch takes about
+        as long as a single ping.
+        """
+        async def ping(ip_address):
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *(PING_COMMAND + (ip_address,)),
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL)
+            except OSError:
+                return None
+            return await process.wait()
+
+        async def ping_all(devices):
+            return await asyncio.gather(
+                *[ping(device.oob_ip_address) for device in devices])
+
+        devices = list(devices)
+        for device, response in zip(devices, asyncio.run(ping_all(devices))):
+            device._set_ping_status(response)
+
+    def _set_ping_status(self, response):
+        """Set the ping status from the exit code of the ping command."""
+        if response == 0:
             self.status_ping = 'up'
         else:
             self.status_ping = 'down'
@@ -12,8 +12,10 @@ LIDAR, etc.
 
 """
 
-from geojson import Feature, Point, LineString
-from gis_utilities import distance, get_altitude
+from geojson import Feature
+from .gis_utilities import (ElevationError, _haversine, get_altitude,
+                            get_altitudes)
+import numpy as np
 
 
 class DeploymentFeature(Feature):
@@ -23,7 +25,11 @@ class DeploymentFeature(Feature):
 
     """
 
-    def __init__(self, id, geometry, subtype, properties):
+    # Set while a Datastore bulk load is in progress; the Datastore then
+    # normalizes the precision of all loaded features in a single pass.
+    defer_normalize = False
+
+    def __init__(self, id, geometry, subtype, properties, unchecked=False):
         """Initialise a DeploymentFeature with the given parameters.
 
         :param id: Identifier assigned to the object.
@@ -34,12 +40,33 @@ class DeploymentFeature(Feature):
         :type subtype: str
         :param desc: Short description associated with the object.
         :type desc: str
+        :param unchecked: Store trusted data as is, skipping geojson
+            validation and conversion of the geometry.
+        :type unchecked: bool
         :return: A DeploymentFeature object
         :rtype: DeploymentFeature
         """
-        super(DeploymentFeature, self).__init__(id, geometry, properties)
-        self['type'] = 'Feature'
-        self.normalize_precision()
+        if unchecked:
+            dict.__init__(self)
+            self['id'] = id
+            self['geometry'] = geometry
+            self['properties'] = properties or {}
+            self['type'] = 'Feature'
+        else:
+            super(DeploymentFeature, self).__init__(id, geometry, properties)
+            self['type'] = 'Feature'
+        if not self.defer_normalize:
+            self.normalize_precision()
+
+    def __setattr__(self, name, value):
+        """Set attributes, using the setters of DeploymentFeature properties.
+
+        geojson objects store any other attribute as a dict item.
+        """
+        if isinstance(getattr(type(self), name, None), property):
+            object.__setattr__(self, name, value)
+        else:
+            super(DeploymentFeature, self).__setattr__(name, value)
 
     @property
     def subtype(self):
@@ -51,19 +78,50 @@ class DeploymentFeature(Feature):
         """Set type of object: 'site','mountpoint', or 'observation'."""
         if value not in ['site', 'mountpoint', 'observation']:
             raise AttributeError()
-        self.properties['subtype'] = value
+        self.update_properties({'subtype': value})
+
+    @property
+    def geometry_type(self):
+        """Return the geometry type of the object, such as 'Point'."""
+        return self.geometry['type'] if self.geometry else None
 
     @property
     def coordinates(self):
         """The coordinates of the object."""
         return self.geometry['coordinates']
 
+    @property
+    def _lnglat(self):
+        """The [lng, lat] positions of a Point or LineString as an array.
+
+        Altitudes are left out, so the vertices of a line always form an
+        (n, 2) float64 array. The array is read only and cached until the
+        coordinates are changed with update_coordinates. Other geometry
+        types give None.
+        """
+        # Kept in the instance __dict__; geojson objects store attributes
+        # set the usual way as dict items, which would be serialized.
+        lnglat = self.__dict__.get('_lnglat_cache')
+        if lnglat is None:
+            coordinates = self.coordinates
+            if self.geometry_type == 'Point':
+                coordinates = coordinates[:2]
+            elif self.geometry_type == 'LineString':
+                coordinates = [vertex[:2] for vertex in coordinates]
+            else:
+                return None
+            lnglat = np.array(coordinates, dtype=np.float64)
+            lnglat.setflags(write=False)
+            self.__dict__['_lnglat_cache'] = lnglat
+        return lnglat
+
     @property
     def length(self):
         """The length of the object."""
-        if isinstance(self.geometry, LineString):
-            coords1, coords2 = self.coordinates
-            return distance(coords1, coords2)
+        if self.geometry_type == 'LineString':
+            lnglat = self._lnglat
+            return round(_haversine(lnglat[0, 1], lnglat[0, 0],
+                                    lnglat[1, 1], lnglat[1, 0]), 1)
         else:
             return 0.0
 
@@ -71,36 +129,36 @@ class DeploymentFeature(Feature):
         """Update a feature precision to avoid excessive decimals."""
         def nomalized_precision(coordinates):
             """Normalize coordinates [x, y, z] to 10 to11 cm of precision."""
-            if len(coordinates) is 2:
-                return [float('{:.6f}'.format(float(coordinates[0]))),
-                        float('{:.6f}'.format(float(coordinates[1])))]
+            if len(coordinates) == 2:
+                return [round(float(coordinates[0]), 6),
+                        round(float(coordinates[1]), 6)]
 
-            elif len(coordinates) is 3:
-                return [float('{:.6f}'.format(float(coordinates[0]))),
-                        float('{:.6f}'.format(float(coordinates[1]))),
-                        float('{:.1f}'.format(float(coordinates[2])))]
+            elif len(coordinates) == 3:
+                return [round(float(coordinates[0]), 6),
+                        round(float(coordinates[1]), 6),
+                        round(float(coordinates[2]), 1)]
 
         try:
-            if isinstance(self.geometry, Point):
-                coordinates = nomalized_precision(self.coordinates)
-                self.geometry['coordinates'] = coordinates
+            coordinates = self.geometry['coordinates']
+            if self.geometry_type == 'Point':
+                self.update_coordinates(nomalized_precision(coordinates))
 
-            elif isinstance(self.geometry, LineString):
+            elif self.geometry_type == 'LineString':
+                coordinates = list(coordinates)
                 # Transform the first coordinate set in the line.
-                coordinates0 = nomalized_precision(self.coordinates[0])
-                self.geometry['coordinates'][0] = coordinates0
+                coordinates[0] = nomalized_precision(coordinates[0])
 
                 # Transform the second coordinate set in the line.
-                coordinates1 = nomalized_precision(self.coordinates[1])
-                self.geometry['coordinates'][1] = coordinates1
-        except (KeyError, TypeError):
-            print 'failed precision checking'
+                coordinates[1] = nomalized_precision(coordinates[1])
+                self.update_coordinates(coordinates)
+        except (IndexError, KeyError, TypeError, ValueError):
+            print('failed precision checking')
 
         return self
 
     def remove_unused_properties(self):
         """Strip unused properties from the DeploymentFeature."""
-        unused_props = [n for n, v in self.properties.iteritems() if v == '']
+        unused_props = [n for n, v in self.properties.items() if v == '']
         for p_name in unused_props:
             print('{}=>DELETED for ({})'.format(p_name, self.id))
             del self.properties[p_name]
@@ -109,8 +167,20 @@ class DeploymentFeature(Feature):
         """Update the DeploymentFeatures properties.
 
         Default behavior is to overwrite existing properties if provided.
+        Change the subtype here or through the subtype property, not by
+        editing the properties dict, so a Datastore holding the feature can
+        move it to the right subtype.
         """
+        subtype = self.subtype
         self.properties.update(properties)
+        listener = self.__dict__.get('_subtype_listener')
+        if listener is not None and self.subtype != subtype:
+            listener(self)
+
+    def update_coordinates(self, coordinates):
+        """Replace the geometry coordinates and drop the cached array."""
+        self.geometry['coordinates'] = coordinates
+        self.__dict__['_lnglat_cache'] = None
 
     def update_icon(self, color='white', size='small'):
         """Update leaflet.js display properties using human readable input.
@@ -132,12 +202,12 @@ class DeploymentFeature(Feature):
             'large': 5
         }
 
-        if isinstance(self.geometry, Point):
+        if self.geometry_type == 'Point':
             self.update_properties({
                 'marker-color': COLOR_MAP[color],
                 'marker-size': size})
 
-        if isinstance(self.geometry, LineString):
+        if self.geometry_type == 'LineString':
             self.update_properties({
                 'stroke': color,
                 'stroke-width': SIZE_MAP[size],
@@ -149,10 +219,28 @@ class DeploymentFeature(Feature):
         Optionally add an additional offset for elevations that are above
         ground elevation(such as most/all mountpoints).
         """
-        if isinstance(self.geometry, Point):
-            lng, lat = self.coordinates[0:2]
+        if self.geometry_type == 'Point':
+            lng, lat = self._lnglat.tolist()
             try:
                 alt = get_altitude(lat, lng, height_offset)
-                self.geometry['coordinates'] = [lng, lat, alt]
+                self.update_coordinates([lng, lat, alt])
             except:
-                print 'ERROR: Requesting altitude data'
+                print('ERROR: Requesting altitude data')
+
+    @classmethod
+    def infer_altitudes(cls, features, height_offset=0.0):
+        """Add elevation/altitude data to many mountpoints or sites at once.
+
+        Same as infer_altitude, but the altitudes of all features are fetched
+        with batched requests.
+        """
+        points = [f for f in features if f.geometry_type == 'Point']
+        locations = [tuple(f._lnglat[::-1].tolist()) for f in points]
+        try:
+            altitudes = get_altitudes(locations, height_offset)
+        except ElevationError:
+            print('ERROR: Requesting altitude data')
+            return
+
+        for feature, (lat, lng), alt in zip(points, locations, altitudes):
+            feature.update_coordinates([lng, lat, alt])
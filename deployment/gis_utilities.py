@@ -1,9 +1,35 @@
 """Simpe utilities to manipulate geospatial data."""
 
 from math import radians, cos, sin, atan2, sqrt
-from time import sleep
-from urllib import urlencode, urlopen
-from simplejson import load
+from os import environ
+import aiolimiter
+import asyncio
+import httpx
+import numba
+import weakref
+
+
+BASE_URL = 'https://maps.googleapis.com/maps/api/elevation/json'
+API_KEY = environ.get('GOOGLE_MAPS_API_KEY')
+MAX_LOCATIONS = 512  # Most locations the elevation api accepts per request
+MAX_REQUESTS_PER_SECOND = 40  # Stay below the elevation api qps limit
+MAX_CACHED_ELEVATIONS = 4096
+
+# Elevations already requested, keyed on (lat, lng) rounded to 6 decimals.
+_elevation_cache = {}
+
+# Async requests still in flight, keyed like the cache.
+_elevation_requests = {}
+
+# Keep-alive session shared by all blocking requests, and the rate limit for
+# async requests, which can otherwise be issued faster than the api allows.
+# A limiter only works within one event loop, so each loop gets its own.
+_session = httpx.Client(http2=True)
+_limiters = weakref.WeakKeyDictionary()
+
+
+class ElevationError(Exception):
+    """The elevation api request failed or did not return the elevations."""
 
 
 def get_altitude(lattitude, longitude, offset=0.0):
@@ -12,34 +38,177 @@ def get_altitude(lattitude, longitude, offset=0.0):
 
     NOTE: the geojson spec of x, y, z order (easting, northing,
     altitude for coordinates) and not lat, lng, alt.
+
+    Raise ElevationError if the altitude can not be requested.
     """
-    coordinates = '{},{}'.format(lattitude, longitude)
-    BASE_URL = 'http://maps.google.com/maps/api/elevation/json'
-    url = BASE_URL + '?' + urlencode({'locations': coordinates})
-    response = load(urlopen(url))['results'][0]['elevation']
-    print('At {}, the altitude is {}'.format(coordinates, response))
-    sleep(1)  # Play nice with the api and wait
-    return float('{:.1f}'.format(offset + float(response)))
+    return get_altitudes([(lattitude, longitude)], offset)[0]
 
 
-def distance(coordinates1, coordinates2):
+async def get_altitude_async(lattitude, longitude, offset=0.0, client=None):
     """
-    Return the distance in meters between two points.
+    Return the altitude of a latitude and longitude without blocking.
 
-    Accept coordinates in [x, y, z] or [lng, lat, alt]. Ignore altitude due to
-    common accuracy issues.
+    Requests are rate limited to MAX_REQUESTS_PER_SECOND across all callers,
+    and concurrent lookups of the same point share a single request. Pass an
+    httpx.AsyncClient as client to reuse its connections; otherwise every
+    request opens and closes its own client.
+    Raise ElevationError if the altitude can not be requested.
+    """
+    key = (round(float(lattitude), 6), round(float(longitude), 6))
+    elevation = _elevation_cache.get(key)
+    if elevation is None:
+        request = _elevation_requests.get(key)
+        if request is None:
+            request = asyncio.ensure_future(
+                _request_elevation_async(key, client))
+            _elevation_requests[key] = request
+            request.add_done_callback(
+                lambda _: _elevation_requests.pop(key, None))
+        elevation = await asyncio.shield(request)
+    return round(offset + elevation, 1)
+
+
+def get_altitudes(points, offset=0.0):
+    """
+    Return the altitudes of a list of (latitude, longitude) points.
+
+    Points are requested from the elevation api in batches of up to
+    MAX_LOCATIONS per request. Elevations are cached, so points that were
+    already requested are not requested again. Raise ElevationError if the
+    altitudes can not be requested.
+    """
+    keys = [(round(float(lat), 6), round(float(lng), 6))
+            for lat, lng in points]
+    elevations = {k: _elevation_cache[k] for k in keys
+                  if k in _elevation_cache}
+    missing = [k for k in dict.fromkeys(keys) if k not in elevations]
+
+    for i in range(0, len(missing), MAX_LOCATIONS):
+        batch = missing[i:i + MAX_LOCATIONS]
+        elevations.update(zip(batch, _request_elevations(batch)))
+
+    for key in missing:
+        _cache_elevation(key, elevations[key])
+
+    return [round(offset + elevations[k], 1) for k in keys]
+
+
+def _cache_elevation(key, elevation):
+    """Cache an elevation, dropping the oldest entry when the cache is full."""
+    if len(_elevation_cache) >= MAX_CACHED_ELEVATIONS:
+        del _elevation_cache[next(iter(_elevation_cache))]
+    _elevation_cache[key] = elevation
+
+
+def _elevation_params(locations):
+    """Return the elevation api query parameters for (lat, lng) pairs."""
+    coordinates = '|'.join('{},{}'.format(lat, lng) for lat, lng in locations)
+    params = {'locations': coordinates}
+    if API_KEY:
+        params['key'] = API_KEY
+    return params
+
+
+def _parse_elevations(response, count):
+    """Return the elevations from an elevation api response.
+
+    Raise ElevationError unless the response is OK and holds count results.
     """
-    (lat1, long1) = (float(x) for x in coordinates1[0:2])
-    (lat2, long2) = (float(x) for x in coordinates2[0:2])
+    try:
+        response.raise_for_status()
+        data = response.json()
+    except (httpx.HTTPError, ValueError) as error:
+        raise ElevationError('elevation request failed: {}'.format(error))
+
+    if data.get('status') != 'OK':
+        raise ElevationError('elevation request failed: {} {}'.format(
+            data.get('status'), data.get('error_message', '')).strip())
+
+    results = data.get('results', [])
+    if len(results) != count:
+        raise ElevationError('expected {} elevations, received {}'.format(
+            count, len(results)))
+    return [float(result['elevation']) for result in results]
+
+
+def _request_elevations(locations):
+    """Request the elevations of a list of (lat, lng) pairs in one call."""
+    try:
+        response = _session.get(BASE_URL, params=_elevation_params(locations))
+    except httpx.HTTPError as error:
+        raise ElevationError('elevation request failed: {}'.format(error))
+    elevations = _parse_elevations(response, len(locations))
+    print('Received the altitude of {} locations'.format(len(elevations)))
+    return elevations
+
+
+def _get_limiter():
+    """Return the async rate limiter for the running event loop."""
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = aiolimiter.AsyncLimiter(MAX_REQUESTS_PER_SECOND, 1)
+        _limiters[loop] = limiter
+    return limiter
+
+
+async def _request_elevation_async(key, client=None):
+    """Request and cache the elevation of a single (lat, lng) pair."""
+    if client is None:
+        async with httpx.AsyncClient(http2=True) as client:
+            return await _request_elevation_async(key, client)
+
+    async with _get_limiter():
+        try:
+            response = await client.get(BASE_URL,
+                                        params=_elevation_params([key]))
+        except httpx.HTTPError as error:
+            raise ElevationError('elevation request failed: {}'.format(error))
+    elevation = _parse_elevations(response, 1)[0]
+    _cache_elevation(key, elevation)
+    return elevation
+
+
+@numba.njit(cache=True, fastmath=True)
+def _haversine(lat1, lon1, lat2, lon2):
+    """Return the great circle distance in meters between two lat/lng pairs."""
     radius = 6371 * 1000  # radius of earth in meters
     dlat = radians(lat2 - lat1)
-    dlon = radians(long2 - long1)
+    dlon = radians(lon2 - lon1)
     a = sin(dlat / 2) * sin(dlat / 2) \
         + cos(radians(lat1)) * cos(radians(lat2)) \
         * sin(dlon / 2) * sin(dlon / 2)
     c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    d = radius * c
-    return float('{:.1f}'.format(d))
+    return radius * c
+
+
+# Parallel ufunc form of _haversine, compiled on first use of haversine_vec.
+_haversine_ufunc = None
+
+
+def haversine_vec(lat1, lon1, lat2, lon2):
+    """Return the distances in meters between arrays of lat/lng pairs.
+
+    Array form of _haversine for computing many distances in a single call.
+    """
+    global _haversine_ufunc
+    if _haversine_ufunc is None:
+        _haversine_ufunc = numba.vectorize(
+            ['float64(float64, float64, float64, float64)'],
+            target='parallel')(_haversine.py_func)
+    return _haversine_ufunc(lat1, lon1, lat2, lon2)
+
+
+def distance(coordinates1, coordinates2):
+    """
+    Return the distance in meters between two points.
+
+    Accept coordinates in [x, y, z] or [lng, lat, alt]. Ignore altitude due to
+    common accuracy issues.
+    """
+    d = _haversine(float(coordinates1[1]), float(coordinates1[0]),
+                   float(coordinates2[1]), float(coordinates2[0]))
+    return round(d, 1)
 
 
 def calc_azimuth_elevation(origin, destination):